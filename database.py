@@ -1,8 +1,135 @@
 from replit import db
-from datetime import datetime, timedelta
-import json
+import base64
+import bisect
 from collections import OrderedDict
-from statistics import mean
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+import logging
+import re
+import struct
+import threading
+import numpy as np
+import orjson
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Replit DB serves one key per HTTP request, so range reads fan out over a
+# shared pool rather than paying each round-trip in turn
+_DB_WORKERS = 16
+_EXECUTOR = ThreadPoolExecutor(max_workers=_DB_WORKERS)
+
+# The Replit DB client keeps only 10 pooled connections by default. Any
+# worker beyond that opens a fresh connection and throws it away after the
+# request, so the pool is sized to the executor, keeping the client's retries.
+if db is not None:
+    for _scheme in ('http://', 'https://'):
+        _retries = db.sess.get_adapter(_scheme).max_retries
+        db.sess.mount(_scheme, HTTPAdapter(pool_maxsize=_DB_WORKERS, max_retries=_retries))
+
+# Writes are always normalized, so nearly every key is an aligned timestamp.
+# Keys matching this pattern (minutes on a 15-minute boundary, seconds absent
+# or zero, optionally followed by a fraction or UTC offset) are kept without
+# parsing; anything else goes through the full datetime check.
+_ALIGNED_KEY = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:(00|15|30|45)(:00)?(?![\d:])')
+
+# Each row is stored as three little-endian int16 counts (severes, warnings,
+# alerts), base64-encoded since Replit DB values are strings. The timestamp is
+# the key itself, so it is not repeated in the value.
+_COUNTS_FORMAT = struct.Struct('<hhh')
+
+# New counts only arrive once per 15-minute bucket, so the latest row is
+# served from memory for the rest of the bucket it was read or written in
+_latest_cache = {'bucket': None, 'data': None}
+_latest_lock = threading.Lock()
+
+# Process-local sorted copy of the database keys. It is loaded once on first
+# use and kept current by store_counts, so reads can bisect it instead of
+# listing every key over the network.
+_key_index = None
+_key_index_version = 0
+_key_index_lock = threading.Lock()
+
+# Stored rows never change once written except through store_counts, so
+# decoded rows are kept in a bounded LRU cache (about six weeks of 15-minute
+# rows) and range reads only fetch keys that have not been seen recently
+_ROW_CACHE_SIZE = 4096
+_row_cache = OrderedDict()
+_row_cache_lock = threading.Lock()
+
+def _ensure_key_index():
+    """Load the sorted key index from the database if it is not loaded yet"""
+    global _key_index
+    if _key_index is None:
+        _key_index = sorted(db.keys())
+        logger.debug("Loaded %d keys into the key index", len(_key_index))
+
+def _index_add(key):
+    """Record a newly written key in the key index"""
+    global _key_index_version
+    with _key_index_lock:
+        # Bumped even when the key already exists, since its value changed
+        _key_index_version += 1
+        _ensure_key_index()
+        # New counts almost always carry the newest timestamp, so appending
+        # skips both the search and the list shift
+        if not _key_index or key > _key_index[-1]:
+            _key_index.append(key)
+            return
+        position = bisect.bisect_left(_key_index, key)
+        if position == len(_key_index) or _key_index[position] != key:
+            _key_index.insert(position, key)
+
+def _index_remove(key):
+    """Drop a deleted key from the key index"""
+    global _key_index_version
+    with _key_index_lock:
+        _key_index_version += 1
+        if _key_index is None:
+            return
+        position = bisect.bisect_left(_key_index, key)
+        if position < len(_key_index) and _key_index[position] == key:
+            del _key_index[position]
+
+def _keys_between(start_str, end_str):
+    """Return the stored keys between two ISO timestamps, in order"""
+    with _key_index_lock:
+        _ensure_key_index()
+        lo = bisect.bisect_left(_key_index, start_str)
+        hi = bisect.bisect_right(_key_index, end_str)
+        return _key_index[lo:hi]
+
+def _latest_key():
+    """Return the most recent stored key, or None if the database is empty"""
+    with _key_index_lock:
+        _ensure_key_index()
+        return _key_index[-1] if _key_index else None
+
+def _cache_row(key, row, overwrite=True):
+    """Remember a decoded row, evicting the least recently used if full.
+    
+    With overwrite=False an entry already cached for the key is kept, since
+    a concurrent store_counts may have cached a newer row. Returns the row
+    now cached for the key.
+    """
+    with _row_cache_lock:
+        if overwrite or key not in _row_cache:
+            _row_cache[key] = row
+        _row_cache.move_to_end(key)
+        if len(_row_cache) > _ROW_CACHE_SIZE:
+            _row_cache.popitem(last=False)
+        return _row_cache[key]
+
+def _uncache_row(key):
+    """Forget the decoded row for a deleted key"""
+    with _row_cache_lock:
+        _row_cache.pop(key, None)
+
+def _current_bucket():
+    """Return the 15-minute bucket containing the current time"""
+    now = datetime.now()
+    return now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0).isoformat()
 
 def _normalize_timestamp(timestamp):
     """Normalize timestamp to nearest 15-minute interval"""
@@ -11,86 +138,123 @@ def _normalize_timestamp(timestamp):
     normalized_minutes = (minutes // 15) * 15
     return dt.replace(minute=normalized_minutes, second=0, microsecond=0).isoformat()
 
-def _cleanup_intermediate_timestamps():
-    """Clean up timestamps that don't align with 15-minute intervals"""
-    keys_to_remove = []
-    for key in db.keys():
-        try:
-            timestamp = datetime.fromisoformat(key)
-            if timestamp.minute % 15 != 0 or timestamp.second != 0:
-                keys_to_remove.append(key)
-        except (ValueError, TypeError):
-            continue
-    
-    for key in keys_to_remove:
-        del db[key]
+def _is_misaligned(key):
+    """Check whether a key is a timestamp off the 15-minute grid"""
+    if _ALIGNED_KEY.match(key):
+        return False
+    try:
+        timestamp = datetime.fromisoformat(key)
+    except (ValueError, TypeError):
+        return False
+    return timestamp.minute % 15 != 0 or timestamp.second != 0
 
-class OrderedJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, OrderedDict):
-            return dict(obj)
-        return super().default(obj)
+def cleanup_intermediate_timestamps():
+    """Clean up timestamps that don't align with 15-minute intervals"""
+    try:
+        keys_to_remove = [key for key in db.keys() if _is_misaligned(key)]
+        
+        for key in keys_to_remove:
+            del db[key]
+            _index_remove(key)
+            _uncache_row(key)
+        logger.debug("Removed %d misaligned timestamps", len(keys_to_remove))
+    except Exception as e:
+        logger.exception("Error cleaning up intermediate timestamps: %s", e)
 
 def _create_ordered_response(data):
     """Create consistently ordered response dictionary"""
-    return OrderedDict([
-        ('timestamp', data.get('timestamp')),
-        ('severes', data.get('severes', 0)),
-        ('warnings', data.get('warnings', 0)),
-        ('alerts', data.get('alerts', 0))
-    ])
+    # Plain dicts keep insertion order, which orjson preserves
+    return {
+        'timestamp': data.get('timestamp'),
+        'severes': data.get('severes', 0),
+        'warnings': data.get('warnings', 0),
+        'alerts': data.get('alerts', 0)
+    }
 
 def _aggregate_data(data_points, interval_hours=1):
-    """Aggregate data points by averaging values over specified interval"""
+    """Aggregate data points by averaging values over specified interval.
+    
+    The aggregated rows are returned in timestamp order.
+    """
     if not data_points:
         return []
     
-    # Sort data points by timestamp
-    sorted_data = sorted(data_points, key=lambda x: x['timestamp'])
-    aggregated_data = []
-    current_group = []
-    interval = timedelta(hours=interval_hours)
+    # Project the rows into columns so the grouping runs as vectorized reductions.
+    # Counts are small non-negative integers, so int16 keeps the matrix compact.
+    timestamps = np.array([d['timestamp'] for d in data_points], dtype='datetime64[s]')
+    counts = np.array(
+        [(d['severes'], d['warnings'], d['alerts']) for d in data_points],
+        dtype=np.int16
+    )
     
-    # Get the first timestamp as reference
-    current_interval_start = datetime.fromisoformat(sorted_data[0]['timestamp'])
+    # Sort once so each interval becomes a contiguous run of rows
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    counts = counts[order]
     
-    for point in sorted_data:
-        timestamp = datetime.fromisoformat(point['timestamp'])
-        if timestamp < current_interval_start + interval:
-            current_group.append(point)
-        else:
-            if current_group:
-                # Calculate averages for the current group
-                avg_data = {
-                    'timestamp': current_interval_start.isoformat(),
-                    'severes': round(mean(d['severes'] for d in current_group)),
-                    'warnings': round(mean(d['warnings'] for d in current_group)),
-                    'alerts': round(mean(d['alerts'] for d in current_group))
-                }
-                aggregated_data.append(_create_ordered_response(avg_data))
-            
-            # Start new group
-            current_interval_start = timestamp
-            current_group = [point]
+    # Fixed-width intervals measured from the first timestamp
+    interval = np.timedelta64(interval_hours, 'h')
+    buckets = (timestamps - timestamps[0]) // interval
+    group_starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    group_sizes = np.diff(np.append(group_starts, len(timestamps)))
+    
+    # Calculate averages for every group at once
+    sums = np.add.reduceat(counts, group_starts, axis=0, dtype=np.int64)
+    averages = np.rint(sums / group_sizes[:, None]).astype(int)
+    interval_starts = np.datetime_as_string(
+        timestamps[0] + buckets[group_starts] * interval, unit='s'
+    )
     
-    # Handle the last group
-    if current_group:
-        avg_data = {
-            'timestamp': current_interval_start.isoformat(),
-            'severes': round(mean(d['severes'] for d in current_group)),
-            'warnings': round(mean(d['warnings'] for d in current_group)),
-            'alerts': round(mean(d['alerts'] for d in current_group))
-        }
-        aggregated_data.append(_create_ordered_response(avg_data))
+    return [
+        _create_ordered_response({
+            'timestamp': timestamp,
+            'severes': severes,
+            'warnings': warnings,
+            'alerts': alerts
+        })
+        for timestamp, (severes, warnings, alerts) in zip(interval_starts.tolist(), averages.tolist())
+    ]
+
+def _encode_counts(data):
+    """Pack the three counts into the compact string stored in the database"""
+    packed = _COUNTS_FORMAT.pack(data['severes'], data['warnings'], data['alerts'])
+    return base64.b64encode(packed).decode('ascii')
+
+def _decode_counts(key, raw):
+    """Decode a stored value back into a response dictionary"""
+    if raw.startswith('"'):
+        # Legacy rows were JSON documents stored through db[key], which
+        # wraps them in a second layer of JSON string encoding
+        return _create_ordered_response(orjson.loads(orjson.loads(raw)))
     
-    return aggregated_data
+    severes, warnings, alerts = _COUNTS_FORMAT.unpack(base64.b64decode(raw))
+    return _create_ordered_response({
+        'timestamp': key,
+        'severes': severes,
+        'warnings': warnings,
+        'alerts': alerts
+    })
+
+def _load_counts(key):
+    """Load and decode the stored counts for a single key.
+    
+    Rows are served from the row cache when possible and cached after a
+    database read. Callers must not mutate the result.
+    """
+    with _row_cache_lock:
+        row = _row_cache.get(key)
+        if row is not None:
+            _row_cache.move_to_end(key)
+            return row
+    
+    return _cache_row(key, _decode_counts(key, db.get_raw(key)), overwrite=False)
 
 def store_counts(timestamp, data):
     """Store flood counts in the database with timestamp validation"""
     try:
         # Normalize the timestamp to nearest 15-minute interval
         normalized_timestamp = _normalize_timestamp(timestamp)
-        print(f"Normalizing timestamp from {timestamp} to {normalized_timestamp}")
+        logger.debug("Normalizing timestamp from %s to %s", timestamp, normalized_timestamp)
         
         # Update the timestamp in the data
         ordered_data = _create_ordered_response({
@@ -100,74 +264,138 @@ def store_counts(timestamp, data):
             'alerts': data.get('alerts', 0)
         })
         
-        # Store the data with normalized timestamp using custom encoder
-        db[normalized_timestamp] = json.dumps(ordered_data, cls=OrderedJSONEncoder, sort_keys=False)
-        print(f"Successfully stored counts in database at {normalized_timestamp}")
+        # Store the packed counts under the normalized timestamp
+        db.set_raw(normalized_timestamp, _encode_counts(ordered_data))
+        _cache_row(normalized_timestamp, ordered_data)
         
-        # Periodically clean up intermediate timestamps
-        _cleanup_intermediate_timestamps()
+        # Serve the new row as the latest counts for the rest of this bucket.
+        # The cache is filled before the index bumps its version, under the
+        # same lock get_latest_counts fills it with, so a read that started
+        # before this write can never put an older row back.
+        with _latest_lock:
+            latest_key = _latest_key()
+            if latest_key is None or normalized_timestamp >= latest_key:
+                _latest_cache['bucket'] = _current_bucket()
+                _latest_cache['data'] = ordered_data
+            _index_add(normalized_timestamp)
+        logger.debug("Successfully stored counts in database at %s", normalized_timestamp)
     except Exception as e:
-        print(f"Error storing counts in database: {e}")
+        logger.exception("Error storing counts in database: %s", e)
 
-def get_latest_counts():
-    """Get the most recent flood counts"""
+def placeholder_counts():
+    """Build the zero-count row served when there is no data to return"""
+    return _create_ordered_response({
+        'timestamp': datetime.now().isoformat()
+    })
+
+def get_latest_counts(fallback=True):
+    """Get the most recent flood counts.
+    
+    If the database cannot be read, placeholder counts are returned, or the
+    error is raised when fallback is False.
+    """
+    bucket = _current_bucket()
+    with _latest_lock:
+        if _latest_cache['bucket'] == bucket:
+            return _latest_cache['data']
+    
     try:
-        keys = list(db.keys())
-        if not keys:
-            print("No data found in database")
-            return _create_ordered_response({
-                'timestamp': datetime.now().isoformat()
-            })
+        # Read the version before the key, so the row is only cached if no
+        # write landed while it was being loaded
+        index_version = _key_index_version
+        latest_key = _latest_key()
+        if latest_key is None:
+            logger.debug("No data found in database")
+            return placeholder_counts()
         
-        latest_key = max(keys)
-        data = json.loads(db[latest_key])
-        print(f"Retrieved latest counts: {data}")
-        return _create_ordered_response(data)
+        latest = _load_counts(latest_key)
+        logger.debug("Retrieved latest counts: %s", latest)
+        with _latest_lock:
+            if _key_index_version == index_version:
+                _latest_cache['bucket'] = bucket
+                _latest_cache['data'] = latest
+        return latest
     except Exception as e:
-        print(f"Error getting latest counts: {e}")
-        return _create_ordered_response({
-            'timestamp': datetime.now().isoformat()
-        })
+        if not fallback:
+            raise
+        logger.exception("Error getting latest counts: %s", e)
+        return placeholder_counts()
+
+def get_data_version():
+    """Get a token that changes whenever the served counts may have changed.
+    
+    The token combines the latest stored key, the key index version (bumped
+    on every write) and the current 15-minute bucket, since the rolling
+    summary window also moves on at each bucket boundary. Returns None if
+    the database cannot be read.
+    """
+    try:
+        latest_key = _latest_key()
+        return f"{latest_key}|{_key_index_version}|{_current_bucket()}"
+    except Exception as e:
+        logger.exception("Error getting data version: %s", e)
+        return None
+
+@lru_cache(maxsize=8)
+def _load_range(first_key, last_key, interval_hours, index_version):
+    """Load the rows between two stored keys, aggregated if requested.
+    
+    Results are cached per key index version, which changes on every write,
+    so repeated queries over the same window (e.g. /api/summary) skip the
+    database until new counts arrive. Callers must not mutate the result.
+    """
+    # ISO timestamp keys sort chronologically, so the slice of the sorted
+    # key index leaves every result list below in timestamp order
+    results = list(_EXECUTOR.map(_load_counts, _keys_between(first_key, last_key)))
+    if interval_hours is not None:
+        results = _aggregate_data(results, interval_hours=interval_hours)
+    return results
 
-def get_counts_between_dates(start_date, end_date):
-    """Get flood counts between two dates with automatic aggregation for longer periods"""
+def get_counts_between_dates(start_date, end_date, fallback=True):
+    """Get flood counts between two dates with automatic aggregation for longer periods.
+    
+    If the database cannot be read, a single placeholder row is returned, or
+    the error is raised when fallback is False.
+    """
     try:
         start_str = start_date.isoformat()
         end_str = end_date.isoformat()
         
-        print(f"Fetching counts between {start_str} and {end_str}")
-        results = []
-        for key in db.keys():
-            if start_str <= key <= end_str:
-                data = json.loads(db[key])
-                results.append(_create_ordered_response(data))
-        
+        logger.debug("Fetching counts between %s and %s", start_str, end_str)
         # Calculate time difference
         time_diff = end_date - start_date
         
-        # Apply aggregation based on time range
+        # Choose aggregation based on time range
         if time_diff > timedelta(days=7):
             # For periods > 7 days, aggregate by 6 hours
-            results = _aggregate_data(results, interval_hours=6)
+            interval_hours = 6
         elif time_diff > timedelta(days=2):
             # For periods > 2 days, aggregate by 2 hours
-            results = _aggregate_data(results, interval_hours=2)
+            interval_hours = 2
         elif time_diff > timedelta(days=1):
             # For periods > 1 day, aggregate by 1 hour
-            results = _aggregate_data(results, interval_hours=1)
+            interval_hours = 1
+        else:
+            interval_hours = None
+        
+        # Read the version before the keys so a concurrent write can only
+        # leave behind a cache entry that is never looked up again
+        index_version = _key_index_version
+        keys_in_range = _keys_between(start_str, end_str)
+        if keys_in_range:
+            results = _load_range(keys_in_range[0], keys_in_range[-1], interval_hours, index_version)
+        else:
+            results = []
         
-        sorted_results = sorted(results, key=lambda x: x['timestamp'])
-        print(f"Found {len(sorted_results)} records")
+        logger.debug("Found %d records", len(results))
         
         # Return at least one data point if no data is found
-        if not sorted_results:
-            return [_create_ordered_response({
-                'timestamp': datetime.now().isoformat()
-            })]
+        if not results:
+            return [placeholder_counts()]
         
-        return sorted_results
+        return results
     except Exception as e:
-        print(f"Error getting counts between dates: {e}")
-        return [_create_ordered_response({
-            'timestamp': datetime.now().isoformat()
-        })]
+        if not fallback:
+            raise
+        logger.exception("Error getting counts between dates: %s", e)
+        return [placeholder_counts()]
@@ -1,58 +1,120 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 import database
 import json
+import logging
+import orjson
+import time
+
+logger = logging.getLogger(__name__)
 
 FLOOD_API_URL = "http://environment.data.gov.uk/flood-monitoring/id/floods"
 
+# Reuse keep-alive connections to the Environment Agency across polls.
+# Only connection and read errors are retried here; error statuses such as
+# 429 and 503 fail the poll straight away and are left to the fetch backoff,
+# rather than sleeping on Retry-After inside the scheduler thread.
+_SESSION = requests.Session()
+_SESSION.headers.update({'Accept': 'application/json'})
+_ADAPTER = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=2,
+    max_retries=Retry(total=3, backoff_factor=0.3, status=0, respect_retry_after_header=False)
+)
+_SESSION.mount('http://', _ADAPTER)
+_SESSION.mount('https://', _ADAPTER)
+
+# Validators from the last full response, so an unchanged feed can be
+# answered with 304 Not Modified instead of resending the body
+_last_response = {'etag': None, 'last_modified': None, 'data': None}
+
+# After a failed fetch (e.g. 429 or 503) polls are skipped for an exponentially
+# growing pause, so a struggling upstream is not hit on every cron tick. The
+# base matches the 15-minute poll interval, so even the first failure skips
+# the next tick.
+_BACKOFF_BASE_SECONDS = 15 * 60
+_BACKOFF_MAX_SECONDS = 2 * 60 * 60
+_backoff = {'failures': 0, 'next_allowed_at': 0.0}
+
+def _record_fetch_failure():
+    """Push back the next allowed fetch after a failure"""
+    _backoff['failures'] += 1
+    delay = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * 2 ** (_backoff['failures'] - 1))
+    _backoff['next_allowed_at'] = time.monotonic() + delay
+    logger.warning("Backing off flood data fetches for %d seconds", delay)
+
 def fetch_flood_data():
     """Fetch flood data from the Environment Agency API"""
     try:
-        print(f"Fetching flood data from {FLOOD_API_URL}")
-        response = requests.get(FLOOD_API_URL)
+        logger.debug("Fetching flood data from %s", FLOOD_API_URL)
+        headers = {}
+        if _last_response['data'] is not None:
+            if _last_response['etag']:
+                headers['If-None-Match'] = _last_response['etag']
+            if _last_response['last_modified']:
+                headers['If-Modified-Since'] = _last_response['last_modified']
+        
+        response = _SESSION.get(FLOOD_API_URL, headers=headers, timeout=(3, 10))
+        if response.status_code == 304:
+            logger.debug("Flood data not modified since last fetch")
+            _backoff['failures'] = 0
+            return _last_response['data']
+        
         response.raise_for_status()
-        data = response.json()
-        print(f"Successfully fetched flood data with {len(data.get('items', []))} items")
+        # orjson parses the raw body bytes directly, skipping requests'
+        # charset detection and the slower stdlib decoder
+        data = orjson.loads(response.content)
+        _backoff['failures'] = 0
+        _last_response['etag'] = response.headers.get('ETag')
+        _last_response['last_modified'] = response.headers.get('Last-Modified')
+        _last_response['data'] = data
+        logger.debug("Successfully fetched flood data with %d items", len(data.get('items', [])))
         return data
     except requests.RequestException as e:
-        print(f"Error fetching flood data: {e}")
+        logger.error("Error fetching flood data: %s", e)
+        _record_fetch_failure()
         return None
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response: {e}")
+        logger.error("Error decoding JSON response: %s", e)
+        _record_fetch_failure()
         return None
 
 def count_severity_levels(flood_data):
     """Count the number of alerts, warnings, and severe warnings"""
     if not flood_data or 'items' not in flood_data:
-        print("Warning: No flood data or items available")
+        logger.warning("No flood data or items available")
         return {'alerts': 0, 'warnings': 0, 'severes': 0}
     
-    counts = {
-        'alerts': 0,    # severity level 3
-        'warnings': 0,  # severity level 2
-        'severes': 0    # severity level 1
-    }
-    
     try:
+        # Tally by severity level index; level 4 (no longer in force) and
+        # missing levels are ignored
+        levels = [0, 0, 0, 0]
         for item in flood_data['items']:
             severity_level = item.get('severityLevel')
-            if severity_level == 3:
-                counts['alerts'] += 1
-            elif severity_level == 2:
-                counts['warnings'] += 1
-            elif severity_level == 1:
-                counts['severes'] += 1
+            if severity_level in (1, 2, 3):
+                levels[severity_level] += 1
         
-        print(f"Counted severity levels: {counts}")
+        counts = {
+            'alerts': levels[3],    # severity level 3
+            'warnings': levels[2],  # severity level 2
+            'severes': levels[1]    # severity level 1
+        }
+        logger.debug("Counted severity levels: %s", counts)
         return counts
     except Exception as e:
-        print(f"Error counting severity levels: {e}")
+        logger.exception("Error counting severity levels: %s", e)
         return {'alerts': 0, 'warnings': 0, 'severes': 0}
 
 def fetch_and_store_flood_data():
     """Fetch flood data and store counts in the database"""
     try:
-        print("Starting flood data fetch and store process")
+        if time.monotonic() < _backoff['next_allowed_at']:
+            logger.info("Skipping flood data fetch after %d failed attempts", _backoff['failures'])
+            return
+        
+        logger.debug("Starting flood data fetch and store process")
         flood_data = fetch_flood_data()
         if flood_data:
             counts = count_severity_levels(flood_data)
@@ -66,8 +128,8 @@ def fetch_and_store_flood_data():
             }
             
             database.store_counts(timestamp, data)
-            print(f"Successfully stored flood data: {data}")
+            logger.info("Successfully stored flood data: %s", data)
         else:
-            print("No flood data available to store")
+            logger.warning("No flood data available to store")
     except Exception as e:
-        print(f"Error in fetch_and_store_flood_data: {e}")
+        logger.exception("Error in fetch_and_store_flood_data: %s", e)
@@ -1,25 +1,18 @@
-from flask import Flask, render_template, jsonify, request
-from flask.json.provider import DefaultJSONProvider
+from flask import Flask, abort, render_template, request
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 import flood_service
 import database
-import json
-from collections import OrderedDict
+import hashlib
+import logging
+import numpy as np
+import orjson
+import re
 
-class OrderedJSONProvider(DefaultJSONProvider):
-    def dumps(self, obj, **kwargs):
-        # Ensure that the order is preserved during JSON serialization
-        kwargs['sort_keys'] = False
-        return super().dumps(obj, **kwargs)
-
-    def default(self, obj):
-        if isinstance(obj, OrderedDict):
-            return dict(obj)
-        return super().default(obj)
+# Module loggers only emit DEBUG detail when troubleshooting
+logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
-app.json = OrderedJSONProvider(app)
 
 # Initialize the scheduler with timezone awareness
 scheduler = BackgroundScheduler()
@@ -31,6 +24,50 @@ scheduler.add_job(
 )
 scheduler.start()
 
+# Browsers poll the dashboards every minute, while the data only changes every
+# 15 minutes, so let clients reuse a response for one polling interval
+CACHE_MAX_AGE_SECONDS = 60
+
+# Date query parameters, matched up front rather than left to fromisoformat,
+# which also accepts times, offsets and basic or week-date forms
+_DATE_PARAM = re.compile(r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})')
+
+def _json_response(data):
+    """Build a JSON response straight from orjson's bytes, skipping jsonify"""
+    return app.response_class(orjson.dumps(data), mimetype='application/json')
+
+def _cacheable(response):
+    """Mark a response as cacheable by clients and shared caches"""
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE_SECONDS
+    return response
+
+def _data_etag():
+    """Derive a strong ETag for responses built from the latest counts"""
+    version = database.get_data_version()
+    if version is None:
+        return None
+    return hashlib.blake2b(version.encode(), digest_size=8).hexdigest()
+
+def _conditional_json_response(etag, build_data, build_fallback):
+    """Answer 304 if the client's ETag is current, else build a JSON response.
+    
+    If-None-Match uses weak comparison, so W/ tags from compressing proxies
+    still match. If build_data raises, the fallback is served without an ETag or cache
+    headers, so clients pick up real data as soon as the database recovers.
+    """
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            response = _json_response(build_data())
+        except Exception as e:
+            app.logger.exception("Error building response: %s", e)
+            return _json_response(build_fallback())
+    if etag is not None:
+        response.set_etag(etag)
+    return _cacheable(response)
+
 @app.route('/')
 def index():
     """Render the trend page (new homepage)"""
@@ -49,8 +86,24 @@ def api_docs():
 @app.route('/api/current')
 def get_current_counts():
     """Get the most recent flood counts"""
-    current_data = database.get_latest_counts()
-    return jsonify(current_data)
+    return _conditional_json_response(
+        _data_etag(),
+        lambda: database.get_latest_counts(fallback=False),
+        database.placeholder_counts
+    )
+
+def _parse_date_param(value):
+    """Parse a YYYY-MM-DD query parameter as a naive datetime at midnight.
+    
+    Accepts what strptime('%Y-%m-%d') did: a four-digit year and a one- or
+    two-digit month and day. Times, UTC offsets and other ISO 8601 forms
+    raise ValueError, as do out-of-range dates.
+    """
+    match = _DATE_PARAM.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid date: {value!r}")
+    year, month, day = map(int, match.groups())
+    return datetime(year, month, day)
 
 @app.route('/api/historical')
 def get_historical_data():
@@ -58,34 +111,59 @@ def get_historical_data():
     end_date = datetime.now()
     start_date = end_date - timedelta(days=1)  # Default to last 24 hours
     
-    if 'start_date' in request.args:
-        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d')
-    if 'end_date' in request.args:
-        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d')
+    try:
+        if 'start_date' in request.args:
+            start_date = _parse_date_param(request.args['start_date'])
+        if 'end_date' in request.args:
+            end_date = _parse_date_param(request.args['end_date'])
+    except ValueError:
+        abort(400, description='start_date and end_date must be in YYYY-MM-DD format')
     
     historical_data = database.get_counts_between_dates(start_date, end_date)
-    return jsonify(historical_data)
+    return _json_response(historical_data)
 
 @app.route('/api/summary')
 def get_summary():
     """Get summary statistics of flood events"""
+    return _conditional_json_response(
+        _data_etag(),
+        _build_summary,
+        lambda: _summarize([database.placeholder_counts()])
+    )
+
+def _build_summary():
+    """Compute the weekly summary statistics"""
     end_date = datetime.now()
     start_date = end_date - timedelta(days=7)  # Last week summary
     
-    data = database.get_counts_between_dates(start_date, end_date)
+    data = database.get_counts_between_dates(start_date, end_date, fallback=False)
+    return _summarize(data)
+
+def _summarize(data):
+    """Reduce flood count rows to their maximum and average values"""
+    # One pass builds an (N, 3) matrix; the reductions then run column-wise
+    counts = np.array(
+        [(item['alerts'], item['warnings'], item['severes']) for item in data],
+        dtype=np.int32
+    )
+    max_alerts, max_warnings, max_severes = counts.max(axis=0).tolist()
+    avg_alerts, avg_warnings, avg_severes = counts.mean(axis=0).tolist()
     
-    summary = OrderedDict([
-        ('max_alerts', max(item['alerts'] for item in data)),
-        ('max_warnings', max(item['warnings'] for item in data)),
-        ('max_severes', max(item['severes'] for item in data)),
-        ('avg_alerts', sum(item['alerts'] for item in data) / len(data)),
-        ('avg_warnings', sum(item['warnings'] for item in data) / len(data)),
-        ('avg_severes', sum(item['severes'] for item in data) / len(data)),
-    ])
+    summary = {
+        'max_alerts': max_alerts,
+        'max_warnings': max_warnings,
+        'max_severes': max_severes,
+        'avg_alerts': avg_alerts,
+        'avg_warnings': avg_warnings,
+        'avg_severes': avg_severes,
+    }
     
-    return jsonify(summary)
+    return summary
 
 if __name__ == '__main__':
+    # Remove any misaligned legacy timestamps once, before serving
+    database.cleanup_intermediate_timestamps()
+    
     # Fetch initial data
     flood_service.fetch_and_store_flood_data()
     app.run(host='0.0.0.0', port=5000)